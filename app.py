@@ -12,9 +12,22 @@ import csv
 from io import StringIO
 import logging
 import threading
-from sqlalchemy import func
+import heapq
+from collections import Counter
+import tempfile
+from types import MappingProxyType
+from sqlalchemy import func, and_, or_, bindparam
+import atexit
+import signal
+import sys
+import base64
 import pytz
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 app = Flask(__name__)
 app.config['SECRET_KEY'] = secrets.token_hex(16)
 app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///cards.db'
@@ -30,14 +43,108 @@ app.config['RATELIMIT_STORAGE_URL'] = 'memory://'
 app.config['RATELIMIT_STRATEGY'] = 'fixed-window'
 app.config['RATELIMIT_DEFAULT'] = "60/minute"
 
+# 验证接口响应的最长缓存时间（秒），客户端可在此期间根据 expires_at 本地倒计时
+app.config['VERIFY_CACHE_SECONDS'] = 60
+
 db = SQLAlchemy(app)
-socketio = SocketIO(app, cors_allowed_origins="*")
+class FastJSON:
+    """JSON编解码：安装了 orjson 时使用 orjson，否则回退到标准库"""
+    @staticmethod
+    def dumps(obj, **kwargs):
+        if orjson is not None:
+            return orjson.dumps(obj).decode()
+        return json.dumps(obj, **kwargs)
+
+    @staticmethod
+    def loads(s, **kwargs):
+        if orjson is not None:
+            return orjson.loads(s)
+        return json.loads(s, **kwargs)
+
+def fast_jsonify(payload):
+    """使用 FastJSON 编码的 JSON 响应，用于大批量数据"""
+    return app.response_class(FastJSON.dumps(payload), mimetype='application/json')
+
+socketio = SocketIO(app, cors_allowed_origins="*", json=FastJSON)
+
+# 客户端显式提供的设备标识的最大长度
+MAX_DEVICE_TOKEN_LENGTH = 128
+
+# 设备ID哈希密钥文件（位于实例目录，不纳入版本控制）
+DEVICE_ID_KEY_FILE = 'device_id.key'
+DEVICE_ID_KEY_SIZE = 32
+
+def load_device_id_key():
+    """加载设备ID的哈希密钥，启动时调用一次
 
-def generate_device_id(request):
-    """根据请求信息生成设备ID"""
-    # 使用用户代理、IP地址和其他信息生成唯一设备标识
+    优先使用环境变量 DEVICE_ID_KEY（十六进制），否则读取实例目录下的密钥文件；
+    文件不存在时以 O_EXCL 独占创建（权限 0600），多个进程同时启动时只有一个
+    进程生成密钥，其余进程读取该文件。密钥丢失后所有已绑定设备都会变成新设备，
+    因此格式错误时直接报错，而不是重新生成。
+    """
+    key = os.environ.get('DEVICE_ID_KEY')
+    source = '环境变量 DEVICE_ID_KEY'
+    if not key:
+        os.makedirs(app.instance_path, exist_ok=True)
+        path = os.path.join(app.instance_path, DEVICE_ID_KEY_FILE)
+        source = path
+        try:
+            fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        except FileExistsError:
+            # 其他进程可能刚创建文件尚未写完，短暂重试
+            for _ in range(50):
+                with open(path, 'r', encoding='utf-8') as f:
+                    key = f.read().strip()
+                if key:
+                    break
+                time.sleep(0.1)
+        else:
+            key = secrets.token_hex(DEVICE_ID_KEY_SIZE)
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                f.write(key)
+                f.flush()
+                os.fsync(f.fileno())
+    try:
+        key_bytes = bytes.fromhex(key)
+    except (TypeError, ValueError):
+        key_bytes = b''
+    if len(key_bytes) != DEVICE_ID_KEY_SIZE:
+        raise RuntimeError(f'设备ID密钥无效（{source}），应为{DEVICE_ID_KEY_SIZE * 2}位十六进制字符串')
+    return key_bytes
+
+DEVICE_ID_KEY = load_device_id_key()
+
+def generate_device_id(request, data=None):
+    """根据请求信息生成设备ID（32位十六进制）
+
+    客户端可通过请求头 X-Device-Token 或请求体 device_id 提供固定的设备标识，
+    避免代理改写客户端IP时被识别为新设备；否则使用用户代理和IP地址生成。
+    """
+    token = request.headers.get('X-Device-Token')
+    if not token and isinstance(data, dict):
+        token = data.get('device_id')
+    key = DEVICE_ID_KEY
+    if isinstance(token, str) and 0 < len(token) <= MAX_DEVICE_TOKEN_LENGTH:
+        return hashlib.blake2b(token.encode(), digest_size=16, key=key, person=b'device-token').hexdigest()
     device_info = f"{request.user_agent.string}|{request.remote_addr}"
-    return hashlib.md5(device_info.encode()).hexdigest()
+    return hashlib.blake2b(device_info.encode(), digest_size=16, key=key, person=b'device-info').hexdigest()
+
+def generate_legacy_device_id(request):
+    """旧版本按 MD5 生成的设备ID，仅用于把已绑定的旧设备ID迁移为新ID"""
+    device_info = f"{request.user_agent.string}|{request.remote_addr}"
+    return hashlib.md5(device_info.encode(), usedforsecurity=False).hexdigest()
+
+def get_request_json():
+    """解析请求体JSON，每个请求只解析一次并缓存在 g 上"""
+    if 'request_json' not in g:
+        g.request_json = request.get_json(silent=True) if request.is_json else None
+    return g.request_json
+
+def get_device_id():
+    """当前请求的设备ID，每个请求只计算一次并缓存在 g 上"""
+    if 'device_id' not in g:
+        g.device_id = generate_device_id(request, get_request_json())
+    return g.device_id
 
 class RateLimit:
     """请求频率限制实现"""
@@ -48,21 +155,22 @@ class RateLimit:
 
     def is_allowed(self, ip):
         """检查IP是否允许请求"""
+        # 在加锁前读取配置快照：热加载触发的变更回调同样需要获取此锁
+        config = settings.settings
+        window = config.get('rate_limit_window', 60)
+        max_requests = config.get('rate_limit_requests', 60)
+
         with self._lock:  # 使用线程锁保护并发访问
             now = time.time()
             
             # 清理过期的请求记录
             if now - self.last_cleanup > 60:
-                self._cleanup(now)
+                self._cleanup(now, window)
             
             # 获取IP的请求记录
             if ip not in self.requests:
                 self.requests[ip] = []
             
-            # 获取配置的限制
-            window = settings.get('rate_limit_window', 60)
-            max_requests = settings.get('rate_limit_requests', 60)
-            
             # 清理当前IP的过期请求
             self.requests[ip] = [t for t in self.requests[ip] if now - t < window]
             
@@ -74,22 +182,29 @@ class RateLimit:
             self.requests[ip].append(now)
             return True
 
-    def _cleanup(self, now):
+    def _cleanup(self, now, window):
         """清理过期的请求记录"""
-        window = settings.get('rate_limit_window', 60)
         for ip in list(self.requests.keys()):
             self.requests[ip] = [t for t in self.requests[ip] if now - t < window]
             if not self.requests[ip]:
                 del self.requests[ip]
         self.last_cleanup = now
 
+    def on_settings_change(self, old, new):
+        """配置变更回调：时间窗口缩短时立即清理超出新窗口的记录"""
+        window = new.get('rate_limit_window', 60)
+        if window < old.get('rate_limit_window', 60):
+            with self._lock:
+                self._cleanup(time.time(), window)
+
 rate_limiter = RateLimit()
 
 def rate_limit(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
+        config = settings.settings
         # 检查API是否启用
-        if not settings.get('api_enabled', True):
+        if not config.get('api_enabled', True):
             return jsonify({
                 'valid': False,
                 'message': 'API接口已关闭'
@@ -98,11 +213,26 @@ def rate_limit(f):
         if not rate_limiter.is_allowed(request.remote_addr):
             return jsonify({
                 'valid': False,
-                'message': f'请求过于频繁，请在{settings.get("rate_limit_window", 60)}秒后再试'
+                'message': f'请求过于频繁，请在{config.get("rate_limit_window", 60)}秒后再试'
             }), 429
         return f(*args, **kwargs)
     return decorated_function
 
+def ensure_schema():
+    """为已存在的表补充模型中新增的可空列和索引（create_all 不会修改已有表）"""
+    inspector = db.inspect(db.engine)
+    for table in db.metadata.tables.values():
+        existing = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in existing:
+                column_type = column.type.compile(dialect=db.engine.dialect)
+                with db.engine.begin() as conn:
+                    conn.execute(db.text(
+                        f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'
+                    ))
+        for index in table.indexes:
+            index.create(db.engine, checkfirst=True)
+
 def get_local_time():
     """获取本地时间"""
     return datetime.now()
@@ -114,9 +244,57 @@ class Card(db.Model):
     minutes = db.Column(db.Integer, nullable=False)
     created_at = db.Column(db.DateTime, nullable=False, default=get_local_time)
     is_used = db.Column(db.Boolean, default=False)
-    used_at = db.Column(db.DateTime, nullable=True)
+    used_at = db.Column(db.DateTime, nullable=True, index=True)
     device_id = db.Column(db.String(500), nullable=True)  # 存储多个设备ID，用逗号分隔
     max_devices = db.Column(db.Integer, default=1)  # 最大允许设备数量
+    paused_at = db.Column(db.DateTime, nullable=True)  # 暂停时间，暂停期间不计时
+    paused_remaining = db.Column(db.Integer, nullable=True)  # 暂停时的剩余秒数
+    revoked_at = db.Column(db.DateTime, nullable=True)  # 作废时间
+    last_verified_at = db.Column(db.DateTime, nullable=True)  # 最近一次验证时间（定期批量写入）
+    verify_count = db.Column(db.Integer, nullable=True, default=0)  # 验证次数（定期批量写入）
+
+    __table_args__ = (
+        db.Index('ix_card_created_at_id', 'created_at', 'id'),
+    )
+
+    @classmethod
+    def _expiration_expr(cls):
+        """到期时间（儒略日）的SQL表达式"""
+        return func.julianday(cls.used_at) + cls.minutes / 1440.0
+
+    @staticmethod
+    def _epoch_expr(value):
+        """时间的秒级时间戳SQL表达式"""
+        return db.cast(func.strftime('%s', value), db.Integer)
+
+    @classmethod
+    def unused_filter(cls):
+        """未使用（且未作废）的筛选条件"""
+        return and_(cls.is_used == False, cls.revoked_at == None)
+
+    @classmethod
+    def in_use_filter(cls, now):
+        """使用中（已使用、未过期、未暂停且未作废）的筛选条件"""
+        return and_(cls.is_used == True, cls.used_at != None,
+                    cls.paused_at == None, cls.revoked_at == None,
+                    cls._expiration_expr() > func.julianday(now))
+
+    @classmethod
+    def expired_filter(cls, now):
+        """已过期（已使用且已过期，不含暂停和作废）的筛选条件"""
+        return and_(cls.is_used == True, cls.used_at != None,
+                    cls.paused_at == None, cls.revoked_at == None,
+                    cls._expiration_expr() <= func.julianday(now))
+
+    @classmethod
+    def paused_filter(cls):
+        """已暂停（且未作废）的筛选条件"""
+        return and_(cls.paused_at != None, cls.revoked_at == None)
+
+    @classmethod
+    def revoked_filter(cls):
+        """已作废的筛选条件"""
+        return cls.revoked_at != None
 
     @classmethod
     def generate_bulk_cards(cls, minutes, count, max_devices=1):
@@ -137,6 +315,15 @@ class Card(db.Model):
             self.device_id = ','.join(device_list)
         return True, "设备添加成功"
 
+    def replace_device(self, old_device_id, new_device_id):
+        """将已绑定的设备ID替换为新ID，返回是否发生替换"""
+        device_list = self.get_devices()
+        if old_device_id not in device_list or new_device_id in device_list:
+            return False
+        device_list[device_list.index(old_device_id)] = new_device_id
+        self.device_id = ','.join(device_list)
+        return True
+
     def get_devices(self):
         """获取设备ID列表"""
         return self.device_id.split(',') if self.device_id else []
@@ -185,6 +372,13 @@ class Card(db.Model):
 
     def _calculate_remaining_minutes(self):
         """计算卡密剩余分钟数"""
+        if self.revoked_at:
+            return 0
+            
+        if self.paused_at:
+            # 暂停中的卡密，剩余时间冻结在暂停时
+            return max(0, int((self.paused_remaining or 0) / 60))
+            
         if not self.is_used:
             # 未使用的卡密，返回完整时长
             return self.minutes
@@ -206,7 +400,16 @@ class Card(db.Model):
 
     def get_remaining_time(self):
         """获取剩余时间的详细信息"""
-        if not self.is_used:
+        if self.paused_at and not self.revoked_at:
+            remaining_seconds = max(0, self.paused_remaining or 0)
+            return {
+                'hours': remaining_seconds // 3600,
+                'minutes': (remaining_seconds % 3600) // 60,
+                'seconds': remaining_seconds % 60,
+                'total_seconds': remaining_seconds
+            }
+            
+        if not self.is_used and not self.revoked_at:
             return {
                 'hours': 0,
                 'minutes': self.minutes,
@@ -214,7 +417,7 @@ class Card(db.Model):
                 'total_seconds': self.minutes * 60
             }
             
-        if not self.used_at or self.is_expired():
+        if self.revoked_at or not self.used_at or self.is_expired():
             return {
                 'hours': 0,
                 'minutes': 0,
@@ -237,6 +440,68 @@ class Card(db.Model):
             'total_seconds': remaining_seconds
         }
 
+    @classmethod
+    def serialize_columns(cls):
+        """serialize_rows 所需的列，顺序与其解包顺序一致"""
+        return (cls.id, cls.card_key, cls.remark, cls.minutes, cls.is_used,
+                cls.used_at, cls.created_at, cls.max_devices, cls.device_id,
+                cls.paused_at, cls.paused_remaining, cls.revoked_at,
+                cls.last_verified_at, cls.verify_count)
+
+    @staticmethod
+    def serialize_rows(rows, now=None):
+        """批量序列化 serialize_columns 查询出的列元组，结果与 to_dict() 一致
+
+        只读取一次当前时间，并在一次遍历中计算状态和剩余时间，
+        避免逐行构造 ORM 对象和重复的时间运算。
+        """
+        if now is None:
+            now = get_local_time()
+        result = []
+        append = result.append
+        for (card_id, card_key, remark, minutes, is_used, used_at, created_at,
+             max_devices, device_id, paused_at, paused_remaining, revoked_at,
+             last_verified_at, verify_count) in rows:
+            if revoked_at:
+                status = "已作废"
+                remaining_minutes = 0
+            elif paused_at:
+                status = "已暂停"
+                remaining_minutes = max(0, int((paused_remaining or 0) / 60))
+            elif not is_used:
+                status = "未使用"
+                remaining_minutes = minutes
+            elif not used_at:
+                status = "已过期"
+                remaining_minutes = 0
+            else:
+                expiration_time = used_at + timedelta(minutes=minutes)
+                if now >= expiration_time:
+                    status = "已过期"
+                    remaining_minutes = 0
+                else:
+                    status = "使用中"
+                    remaining_seconds = (expiration_time - now).total_seconds()
+                    remaining_minutes = max(0, int(remaining_seconds / 60))
+            append({
+                'id': card_id,
+                'card_key': card_key,
+                'remark': remark if remark else '',
+                'minutes': minutes,
+                'is_used': is_used,
+                'used_at': used_at.isoformat() if used_at else None,
+                'created_at': created_at.isoformat(),
+                'max_devices': max_devices,
+                'device_count': device_id.count(',') + 1 if device_id else 0,
+                'paused_at': paused_at.isoformat() if paused_at else None,
+                'revoked_at': revoked_at.isoformat() if revoked_at else None,
+                'last_verified_at': last_verified_at.isoformat() if last_verified_at else None,
+                'verify_count': verify_count or 0,
+                'status': status,
+                'remaining_minutes': remaining_minutes
+            })
+        return result
+
     def to_dict(self):
         """将卡密对象转换为字典，用于 JSON 序列化"""
         return {
@@ -249,12 +514,20 @@ class Card(db.Model):
             'created_at': self.created_at.isoformat(),
             'max_devices': self.max_devices,
             'device_count': len(self.get_devices()),
+            'paused_at': self.paused_at.isoformat() if self.paused_at else None,
+            'revoked_at': self.revoked_at.isoformat() if self.revoked_at else None,
+            'last_verified_at': self.last_verified_at.isoformat() if self.last_verified_at else None,
+            'verify_count': self.verify_count or 0,
             'status': self.get_status(),
-            'remaining_minutes': self._calculate_remaining_minutes() if self.is_used else self.minutes
+            'remaining_minutes': self._calculate_remaining_minutes()
         }
 
     def is_expired(self):
         """判断卡密是否过期"""
+        if self.paused_at:
+            # 暂停中的卡密不计时，不会过期
+            return False
+            
         if not self.is_used:
             # 未使用的卡密永不过期
             return False
@@ -268,9 +541,35 @@ class Card(db.Model):
         expiration_time = self.used_at + timedelta(minutes=self.minutes)
         return current_time >= expiration_time
 
+    def get_expiration_time(self):
+        """获取到期时间，未使用、暂停或作废的卡密返回 None"""
+        if not self.is_used or not self.used_at or self.paused_at or self.revoked_at:
+            return None
+        return self.used_at + timedelta(minutes=self.minutes)
+
+    def state_etag(self, device_id):
+        """卡密状态版本：卡密状态、过期与否或请求设备变化时改变"""
+        state = '|'.join([
+            str(self.id),
+            str(self.is_used),
+            self.used_at.isoformat() if self.used_at else '',
+            str(self.minutes),
+            str(self.max_devices),
+            self.device_id or '',
+            self.paused_at.isoformat() if self.paused_at else '',
+            self.revoked_at.isoformat() if self.revoked_at else '',
+            device_id,
+            str(self.is_expired())
+        ])
+        return hashlib.sha1(state.encode()).hexdigest()
+
     def get_status(self):
         """获取卡密状态"""
-        if not self.is_used:
+        if self.revoked_at:
+            return "已作废"
+        elif self.paused_at:
+            return "已暂停"
+        elif not self.is_used:
             return "未使用"
         elif self.is_expired():
             return "已过期"
@@ -279,16 +578,155 @@ class Card(db.Model):
 
 def broadcast_card_update():
     """广播卡密更新"""
+    count_cache.invalidate('cards')
     try:
-        cards = Card.query.all()
-        card_list = [card.to_dict() for card in cards]
-        socketio.emit('cards_update', {'cards': card_list})
+        rows = db.session.query(*Card.serialize_columns()).all()
+        socketio.emit('cards_update', {'cards': Card.serialize_rows(rows)})
     except Exception as e:
         app.logger.error(f"广播卡密更新出错: {str(e)}")
 
-class Settings:
+class CardSummary:
+    """首页统计摘要：增量维护各状态卡密数量，避免每次访问都聚合卡密表"""
+    # 全量校准间隔（秒），用于修正多进程写入或异常造成的计数漂移
+    reconcile_interval = 300
+
     def __init__(self):
-        self.config_file = 'config.json'
+        self._lock = threading.Lock()
+        self.unused = 0
+        self.in_use = 0
+        self.expired = 0
+        self.paused = 0
+        self.revoked = 0
+        # 到期时间（按秒向上取整）-> 该时刻到期的使用中卡密数量
+        self._expiry_buckets = {}
+        self._expiry_heap = []
+        self._last_reconcile = None
+
+    @staticmethod
+    def _bucket(used_at, minutes):
+        """计算卡密到期时间所在的时间桶"""
+        expiration_time = used_at + timedelta(minutes=minutes)
+        if expiration_time.microsecond:
+            expiration_time = expiration_time.replace(microsecond=0) + timedelta(seconds=1)
+        return expiration_time
+
+    def _track(self, used_at, minutes, now):
+        """登记一张已使用的卡密（调用方需持有锁）"""
+        if not used_at:
+            # 异常情况：已使用但没有使用时间，按已过期处理
+            self.expired += 1
+            return
+        bucket = self._bucket(used_at, minutes)
+        if bucket <= now:
+            self.expired += 1
+            return
+        self.in_use += 1
+        if bucket not in self._expiry_buckets:
+            self._expiry_buckets[bucket] = 0
+            heapq.heappush(self._expiry_heap, bucket)
+        self._expiry_buckets[bucket] += 1
+
+    def _sweep(self, now):
+        """将已到期时间桶中的卡密从使用中移到已过期（调用方需持有锁）"""
+        while self._expiry_heap and self._expiry_heap[0] <= now:
+            bucket = heapq.heappop(self._expiry_heap)
+            count = self._expiry_buckets.pop(bucket, 0)
+            self.in_use -= count
+            self.expired += count
+
+    def cards_added(self, count=1):
+        """新增未使用卡密（添加、批量生成、导入）"""
+        with self._lock:
+            self.unused += count
+
+    def card_activated(self, card):
+        """卡密首次使用"""
+        with self._lock:
+            now = get_local_time()
+            self._sweep(now)
+            self.unused -= 1
+            self._track(card.used_at, card.minutes, now)
+
+    def card_removed(self, card):
+        """删除卡密，按删除前的状态扣减计数"""
+        with self._lock:
+            now = get_local_time()
+            self._sweep(now)
+            if card.revoked_at:
+                self.revoked -= 1
+                return
+            if card.paused_at:
+                self.paused -= 1
+                return
+            if not card.is_used:
+                self.unused -= 1
+                return
+            bucket = self._bucket(card.used_at, card.minutes) if card.used_at else None
+            if bucket in self._expiry_buckets:
+                self._expiry_buckets[bucket] -= 1
+                if not self._expiry_buckets[bucket]:
+                    # 空桶留在堆中，出堆时计数为0
+                    del self._expiry_buckets[bucket]
+                self.in_use -= 1
+            else:
+                self.expired -= 1
+
+    def invalidate(self):
+        """批量操作后标记计数失效，下次读取时全量校准"""
+        with self._lock:
+            self._last_reconcile = None
+
+    def reconcile(self):
+        """按数据库全量重建计数"""
+        unused = Card.query.filter(Card.unused_filter()).count()
+        paused = Card.query.filter(Card.paused_filter()).count()
+        revoked = Card.query.filter(Card.revoked_filter()).count()
+        rows = db.session.query(Card.used_at, Card.minutes).filter(
+            Card.is_used == True,
+            Card.paused_at == None,
+            Card.revoked_at == None
+        ).all()
+        with self._lock:
+            now = get_local_time()
+            self.unused = unused
+            self.paused = paused
+            self.revoked = revoked
+            self.in_use = 0
+            self.expired = 0
+            self._expiry_buckets = {}
+            self._expiry_heap = []
+            for used_at, minutes in rows:
+                self._track(used_at, minutes, now)
+            self._last_reconcile = time.monotonic()
+
+    def snapshot(self):
+        """返回当前各状态卡密数量"""
+        if (self._last_reconcile is None or
+                time.monotonic() - self._last_reconcile >= self.reconcile_interval):
+            try:
+                self.reconcile()
+            except Exception as e:
+                app.logger.error(f"校准卡密统计出错: {str(e)}")
+        with self._lock:
+            self._sweep(get_local_time())
+            return {
+                'unused': self.unused,
+                'in_use': self.in_use,
+                'expired': self.expired,
+                'paused': self.paused,
+                'revoked': self.revoked,
+                'total': self.unused + self.in_use + self.expired + self.paused + self.revoked
+            }
+
+card_summary = CardSummary()
+
+class Settings:
+    """系统设置：持有不可变快照，按配置文件修改时间热加载"""
+    # 两次检查配置文件修改时间的最小间隔（秒）
+    reload_interval = 2
+
+    def __init__(self, config_file='config.json'):
+        self.config_file = config_file
         self.default_settings = {
             'per_page': 10,
             'rate_limit_requests': 60,
@@ -296,35 +734,110 @@ class Settings:
             'site_name': '卡密管理系统',
             'api_enabled': True
         }
+        self._lock = threading.Lock()
+        self._listeners = []
+        self._mtime = None
+        self._last_check = 0
+        self._snapshot = MappingProxyType(dict(self.default_settings))
         self.load()
 
+    @property
+    def settings(self):
+        """当前配置快照（只读），读取前按需检查配置文件是否被外部修改"""
+        self._maybe_reload()
+        return self._snapshot
+
+    def subscribe(self, callback):
+        """注册配置变更回调，回调参数为 (旧快照, 新快照)"""
+        self._listeners.append(callback)
+
+    def _notify(self, old, new):
+        for callback in list(self._listeners):
+            try:
+                callback(old, new)
+            except Exception as e:
+                app.logger.error(f"配置变更通知出错: {str(e)}")
+
+    def _maybe_reload(self):
+        now = time.monotonic()
+        if now - self._last_check < self.reload_interval:
+            return
+        self._last_check = now
+        try:
+            mtime = os.stat(self.config_file).st_mtime_ns
+        except OSError:
+            return
+        if mtime != self._mtime:
+            self.load()
+
     def load(self):
+        with self._lock:
+            old = self._snapshot
+            try:
+                if os.path.exists(self.config_file):
+                    # 先取修改时间再读取：读取期间文件被改写时，下次检查仍会发现变化
+                    mtime = os.stat(self.config_file).st_mtime_ns
+                    with open(self.config_file, 'r', encoding='utf-8') as f:
+                        loaded = json.load(f)
+                    self._mtime = mtime
+                    self._snapshot = MappingProxyType({**self.default_settings, **loaded})
+                else:
+                    self._snapshot = MappingProxyType(dict(self.default_settings))
+                    self._write(self._snapshot)
+            except Exception as e:
+                # 配置文件损坏或正在写入时保留旧快照
+                app.logger.error(f"加载配置出错: {str(e)}")
+            new = self._snapshot
+        if new != old:
+            self._notify(old, new)
+
+    def _write(self, data):
+        """先写临时文件再原子替换，避免读到写了一半的配置"""
+        directory = os.path.dirname(os.path.abspath(self.config_file))
         try:
-            if os.path.exists(self.config_file):
-                with open(self.config_file, 'r', encoding='utf-8') as f:
-                    self.settings = json.load(f)
-            else:
-                self.settings = self.default_settings
-                self.save()
-        except Exception as e:
-            app.logger.error(f"加载配置出错: {str(e)}")
-            self.settings = self.default_settings
+            mode = os.stat(self.config_file).st_mode & 0o777
+        except OSError:
+            mode = 0o644
+        fd, tmp_path = tempfile.mkstemp(prefix='.config.', suffix='.tmp', dir=directory)
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(dict(data), f, ensure_ascii=False, indent=4)
+                f.flush()
+                os.fsync(f.fileno())
+            # mkstemp 创建的文件权限为 0600，替换前恢复为原配置文件的权限
+            os.chmod(tmp_path, mode)
+            os.replace(tmp_path, self.config_file)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        self._mtime = os.stat(self.config_file).st_mtime_ns
 
     def save(self):
         try:
-            with open(self.config_file, 'w', encoding='utf-8') as f:
-                json.dump(self.settings, f, ensure_ascii=False, indent=4)
+            with self._lock:
+                self._write(self._snapshot)
         except Exception as e:
             app.logger.error(f"保存配置出错: {str(e)}")
 
     def get(self, key, default=None):
         return self.settings.get(key, default)
 
+    def update(self, values):
+        """批量更新配置：生成新快照，写入文件成功后再整体替换"""
+        with self._lock:
+            old = self._snapshot
+            new = MappingProxyType({**old, **values})
+            self._write(new)
+            self._snapshot = new
+        if new != old:
+            self._notify(old, new)
+
     def set(self, key, value):
-        self.settings[key] = value
-        self.save()
+        self.update({key: value})
 
 settings = Settings()
+settings.subscribe(rate_limiter.on_settings_change)
 
 class AccessLog(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -337,6 +850,10 @@ class AccessLog(db.Model):
     user_agent = db.Column(db.String(200))
     card_key = db.Column(db.String(32))  # 如果涉及卡密操作，记录相关卡密
 
+    __table_args__ = (
+        db.Index('ix_access_log_access_time_id', 'access_time', 'id'),
+    )
+
     def to_dict(self):
         return {
             'id': self.id,
@@ -350,6 +867,266 @@ class AccessLog(db.Model):
             'card_key': self.card_key
         }
 
+class CardDevice(db.Model):
+    """卡密各设备的最近验证时间和验证次数"""
+    id = db.Column(db.Integer, primary_key=True)
+    card_id = db.Column(db.Integer, nullable=False)
+    device_id = db.Column(db.String(32), nullable=False)
+    last_seen_at = db.Column(db.DateTime, nullable=False)
+    verify_count = db.Column(db.Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        db.UniqueConstraint('card_id', 'device_id', name='uq_card_device'),
+    )
+
+class LastSeenTracker:
+    """验证记录的写后缓存：在内存中累计每张卡密及设备的最近验证时间和次数，定期批量写入数据库"""
+    # 批量写入间隔（秒）
+    flush_interval = 30
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # card_id -> [最近验证时间, 次数]
+        self._cards = {}
+        # card_id -> {device_id: [最近验证时间, 次数]}
+        self._devices = {}
+        self._worker = None
+
+    def record(self, card_id, device_id, now):
+        """记录一次成功验证，只更新内存"""
+        with self._lock:
+            entry = self._cards.setdefault(card_id, [now, 0])
+            entry[0] = now
+            entry[1] += 1
+            entry = self._devices.setdefault(card_id, {}).setdefault(device_id, [now, 0])
+            entry[0] = now
+            entry[1] += 1
+            if self._worker is None:
+                self._worker = socketio.start_background_task(self._run)
+
+    def discard(self, card_id):
+        """丢弃已删除卡密尚未写入的记录"""
+        with self._lock:
+            self._cards.pop(card_id, None)
+            self._devices.pop(card_id, None)
+
+    def pending(self, card_id):
+        """尚未写入数据库的记录：(卡密记录, {设备ID: 记录})"""
+        with self._lock:
+            card = self._cards.get(card_id)
+            devices = self._devices.get(card_id, {})
+            return (list(card) if card else None,
+                    {device_id: list(entry) for device_id, entry in devices.items()})
+
+    def _merge_back(self, cards, devices):
+        """写入失败时把取出的记录合并回内存（调用方需持有锁）"""
+        for card_id, (seen, count) in cards.items():
+            entry = self._cards.setdefault(card_id, [seen, 0])
+            entry[0] = max(entry[0], seen)
+            entry[1] += count
+        for card_id, card_devices in devices.items():
+            target = self._devices.setdefault(card_id, {})
+            for device_id, (seen, count) in card_devices.items():
+                entry = target.setdefault(device_id, [seen, 0])
+                entry[0] = max(entry[0], seen)
+                entry[1] += count
+
+    def flush(self):
+        """将累计的记录在一个事务中批量写入数据库"""
+        with self._lock:
+            cards, devices = self._cards, self._devices
+            self._cards, self._devices = {}, {}
+        if not cards:
+            return
+        try:
+            card_table = Card.__table__
+            db.session.execute(
+                card_table.update()
+                .where(card_table.c.id == bindparam('b_id'))
+                .values(
+                    last_verified_at=bindparam('b_seen', type_=db.DateTime),
+                    verify_count=func.coalesce(card_table.c.verify_count, 0) + bindparam('b_count')
+                ),
+                [{'b_id': card_id, 'b_seen': seen, 'b_count': count}
+                 for card_id, (seen, count) in cards.items()]
+            )
+            # 只为仍存在的卡密写入设备记录，避免已删除卡密的记录被写回（卡密ID可能被复用）
+            stmt = db.text(
+                'INSERT INTO card_device (card_id, device_id, last_seen_at, verify_count) '
+                'SELECT :card_id, :device_id, :last_seen_at, :verify_count '
+                'WHERE EXISTS (SELECT 1 FROM card WHERE card.id = :card_id) '
+                'ON CONFLICT (card_id, device_id) DO UPDATE SET '
+                'last_seen_at = excluded.last_seen_at, '
+                'verify_count = card_device.verify_count + excluded.verify_count'
+            ).bindparams(bindparam('last_seen_at', type_=db.DateTime))
+            db.session.execute(stmt, [
+                {'card_id': card_id, 'device_id': device_id,
+                 'last_seen_at': seen, 'verify_count': count}
+                for card_id, card_devices in devices.items()
+                for device_id, (seen, count) in card_devices.items()
+            ])
+            db.session.commit()
+        except Exception as e:
+            app.logger.error(f"写入验证记录出错: {str(e)}")
+            db.session.rollback()
+            with self._lock:
+                self._merge_back(cards, devices)
+
+    def _run(self):
+        while True:
+            socketio.sleep(self.flush_interval)
+            with app.app_context():
+                self.flush()
+
+last_seen_tracker = LastSeenTracker()
+
+@atexit.register
+def flush_last_seen():
+    """退出前写入尚未保存的验证记录"""
+    with app.app_context():
+        last_seen_tracker.flush()
+
+class UsageStats:
+    """使用情况统计：按小时预聚合激活与验证记录，增量读取新数据"""
+    # 两次增量读取的最小间隔（秒）
+    refresh_interval = 5
+    # 只读取若干秒之前的记录，等待请求结束后回写状态码、激活事务提交
+    settle_seconds = 10
+    # 内存中保留的统计时长（小时）
+    retention_hours = 24 * 30
+    batch_size = 5000
+    # 每次增量读取的最大批次数，冷启动回填分摊到多次读取中完成
+    max_batches_per_refresh = 10
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._last_refresh = 0
+        self._last_log_id = 0
+        self._activation_watermark = None
+        self.version = 0
+        # 小时时间桶 -> 计数
+        self._activations = {}
+        self._status_codes = {}
+        self._devices = {}
+        self._ips = {}
+
+    @staticmethod
+    def hour_bucket(dt):
+        return dt.replace(minute=0, second=0, microsecond=0)
+
+    def refresh(self):
+        """增量读取上次读取之后的新记录"""
+        if time.monotonic() - self._last_refresh < self.refresh_interval:
+            return
+        # 已有请求正在读取时直接使用当前数据，不排队等待
+        if not self._refresh_lock.acquire(blocking=False):
+            return
+        try:
+            if time.monotonic() - self._last_refresh < self.refresh_interval:
+                return
+            now = get_local_time()
+            cutoff = now - timedelta(seconds=self.settle_seconds)
+            horizon = self.hour_bucket(now) - timedelta(hours=self.retention_hours)
+            if self._activation_watermark is None:
+                self._activation_watermark = horizon
+            changed = self._consume_activations(cutoff)
+            logs_changed, caught_up = self._consume_logs(cutoff, horizon)
+            with self._lock:
+                self._expire(horizon)
+                if changed or logs_changed:
+                    self.version += 1
+            # 未读完（如冷启动回填）时不更新读取时间，下一个请求继续读取
+            if caught_up:
+                self._last_refresh = time.monotonic()
+        finally:
+            self._refresh_lock.release()
+
+    def _consume_activations(self, cutoff):
+        rows = db.session.query(Card.used_at).filter(
+            Card.used_at > self._activation_watermark,
+            Card.used_at <= cutoff
+        ).all()
+        with self._lock:
+            for (used_at,) in rows:
+                bucket = self.hour_bucket(used_at)
+                self._activations[bucket] = self._activations.get(bucket, 0) + 1
+        self._activation_watermark = cutoff
+        return bool(rows)
+
+    def _consume_logs(self, cutoff, horizon):
+        """读取新的验证日志，返回 (是否有新数据, 是否已读完)"""
+        changed = False
+        for _ in range(self.max_batches_per_refresh):
+            rows = db.session.query(
+                AccessLog.id, AccessLog.access_time, AccessLog.status_code,
+                AccessLog.device_id, AccessLog.ip_address
+            ).filter(
+                AccessLog.id > self._last_log_id,
+                AccessLog.path == '/api/verify_card',
+                AccessLog.access_time >= horizon
+            ).order_by(AccessLog.id).limit(self.batch_size).all()
+            with self._lock:
+                for log_id, access_time, status_code, device_id, ip_address in rows:
+                    # access_time 由应用生成，并发时与 id 顺序可能不一致：
+                    # 遇到未过等待期的记录即停止，水位不越过它，下次从这里继续
+                    if access_time > cutoff:
+                        return changed, True
+                    bucket = self.hour_bucket(access_time)
+                    self._status_codes.setdefault(bucket, Counter())[status_code] += 1
+                    self._devices.setdefault(bucket, Counter())[device_id] += 1
+                    self._ips.setdefault(bucket, Counter())[ip_address] += 1
+                    self._last_log_id = log_id
+                    changed = True
+            if len(rows) < self.batch_size:
+                return changed, True
+        return changed, False
+
+    def _expire(self, horizon):
+        """丢弃超出保留时长的时间桶"""
+        for buckets in (self._activations, self._status_codes, self._devices, self._ips):
+            for bucket in [b for b in buckets if b < horizon]:
+                del buckets[bucket]
+
+    def activations(self, start, end, interval='hour'):
+        """按小时或按天返回激活数量序列"""
+        step = timedelta(days=1) if interval == 'day' else timedelta(hours=1)
+        series = {}
+        with self._lock:
+            for bucket, count in self._activations.items():
+                if start <= bucket < end:
+                    key = bucket.replace(hour=0) if interval == 'day' else bucket
+                    series[key] = series.get(key, 0) + count
+        current = start.replace(hour=0) if interval == 'day' else start
+        result = []
+        while current < end:
+            result.append({'time': current.isoformat(), 'count': series.get(current, 0)})
+            current += step
+        return result
+
+    def _merge(self, buckets, start, end):
+        merged = Counter()
+        with self._lock:
+            for bucket, counter in buckets.items():
+                if start <= bucket < end:
+                    merged.update(counter)
+        return merged
+
+    def status_codes(self, start, end):
+        """按状态码统计验证次数"""
+        merged = self._merge(self._status_codes, start, end)
+        return {str(code): count for code, count in sorted(merged.items())}
+
+    def top_devices(self, start, end, limit=10):
+        return [{'device_id': device_id, 'count': count}
+                for device_id, count in self._merge(self._devices, start, end).most_common(limit)]
+
+    def top_ips(self, start, end, limit=10):
+        return [{'ip_address': ip, 'count': count}
+                for ip, count in self._merge(self._ips, start, end).most_common(limit)]
+
+usage_stats = UsageStats()
+
 @app.before_request
 def log_request():
     try:
@@ -364,11 +1141,12 @@ def log_request():
         
         # 只记录定义的卡密操作
         if request.path in card_operations:
-            device_id = generate_device_id(request)
+            device_id = get_device_id()
             # 获取请求中的卡密信息
             card_key = None
-            if request.is_json and request.get_json() and 'card_key' in request.get_json():
-                card_key = request.get_json().get('card_key')
+            data = get_request_json()
+            if isinstance(data, dict) and 'card_key' in data:
+                card_key = data.get('card_key')
             elif request.form and 'card_key' in request.form:
                 card_key = request.form.get('card_key')
             elif '/delete_card/' in request.path:
@@ -409,87 +1187,173 @@ def update_log_status(response):
         error_logger.error(f"更新日志状态出错: {str(e)}", exc_info=True)
     return response
 
+class CountCache:
+    """分页总数缓存：同一筛选条件的 COUNT(*) 在有效期内只执行一次"""
+    ttl = 30
+    max_entries = 256
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}
+
+    def get(self, key, query):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[1] > now:
+                return entry[0]
+        value = query.order_by(None).count()
+        with self._lock:
+            if len(self._entries) >= self.max_entries:
+                self._entries.clear()
+            self._entries[key] = (value, now + self.ttl)
+        return value
+
+    def invalidate(self, namespace):
+        """清除某一类列表（键的第一项）的缓存"""
+        with self._lock:
+            for key in [k for k in self._entries if k[0] == namespace]:
+                del self._entries[key]
+
+count_cache = CountCache()
+
+def encode_cursor(timestamp, row_id):
+    """将 (时间, ID) 编码为不透明的分页游标"""
+    raw = json.dumps([timestamp.isoformat(), row_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+def decode_cursor(cursor):
+    """解析分页游标，格式错误时抛出 ValueError"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        timestamp, row_id = json.loads(raw)
+        return datetime.fromisoformat(timestamp), int(row_id)
+    except (TypeError, ValueError, UnicodeDecodeError) as e:
+        raise ValueError('无效的分页游标') from e
+
+class KeysetPage:
+    """游标分页结果"""
+    def __init__(self, items, total, has_prev, has_next, prev_cursor, next_cursor):
+        self.items = items
+        self.total = total
+        self.has_prev = has_prev
+        self.has_next = has_next
+        self.prev_cursor = prev_cursor
+        self.next_cursor = next_cursor
+
+def keyset_paginate(query, time_column, id_column, per_page, after=None, before=None, total=None):
+    """基于 (时间, ID) 的游标分页，按时间倒序；深页与首页代价相同"""
+    if before:
+        timestamp, row_id = decode_cursor(before)
+        query = query.filter(or_(time_column > timestamp,
+                                 and_(time_column == timestamp, id_column > row_id)))
+        rows = query.order_by(time_column.asc(), id_column.asc()).limit(per_page + 1).all()
+        has_prev = len(rows) > per_page
+        items = list(reversed(rows[:per_page]))
+        has_next = True
+    else:
+        if after:
+            timestamp, row_id = decode_cursor(after)
+            query = query.filter(or_(time_column < timestamp,
+                                     and_(time_column == timestamp, id_column < row_id)))
+        rows = query.order_by(time_column.desc(), id_column.desc()).limit(per_page + 1).all()
+        has_next = len(rows) > per_page
+        items = rows[:per_page]
+        has_prev = bool(after)
+
+    def cursor_of(item):
+        return encode_cursor(getattr(item, time_column.key), getattr(item, id_column.key))
+
+    return KeysetPage(
+        items=items,
+        total=total,
+        has_prev=has_prev and bool(items),
+        has_next=has_next and bool(items),
+        prev_cursor=cursor_of(items[0]) if items else None,
+        next_cursor=cursor_of(items[-1]) if items else None
+    )
+
+# 卡密列表支持的状态筛选
+CARD_STATUS_FILTERS = ('unused', 'used', 'expired', 'paused', 'revoked')
+
+def build_card_query(status, search, now, query=None):
+    """按状态和关键字构建卡密查询"""
+    if query is None:
+        query = Card.query
+    if status == 'unused':
+        query = query.filter(Card.unused_filter())
+    elif status == 'used':
+        query = query.filter(Card.in_use_filter(now))
+    elif status == 'expired':
+        query = query.filter(Card.expired_filter(now))
+    elif status == 'paused':
+        query = query.filter(Card.paused_filter())
+    elif status == 'revoked':
+        query = query.filter(Card.revoked_filter())
+    if search:
+        query = query.filter(Card.card_key.like(f'%{search}%'))
+    return query
+
+def count_cards(query, status, search, summary):
+    """卡密总数：无关键字时直接读取统计摘要，否则使用缓存的 COUNT"""
+    if not search:
+        return {
+            'unused': summary['unused'],
+            'used': summary['in_use'],
+            'expired': summary['expired'],
+            'paused': summary['paused'],
+            'revoked': summary['revoked']
+        }.get(status, summary['total'])
+    return count_cache.get(('cards', status, search), query)
+
+def paginate_cards(status, search, after=None, before=None, raw=False):
+    """卡密分页；raw=True 时返回 serialize_columns 列元组而不是 ORM 对象"""
+    now = get_local_time()
+    summary = card_summary.snapshot()
+    base_query = db.session.query(*Card.serialize_columns()) if raw else None
+    query = build_card_query(status, search, now, base_query)
+    pagination = keyset_paginate(
+        query, Card.created_at, Card.id, settings.get('per_page', 10),
+        after=after, before=before,
+        total=count_cards(query, status, search, summary)
+    )
+    return pagination, summary
+
+def build_log_query(card_key_filter):
+    query = AccessLog.query
+    if card_key_filter:
+        query = query.filter(AccessLog.card_key.like(f'%{card_key_filter}%'))
+    return query
+
+def paginate_logs(card_key_filter, after=None, before=None):
+    query = build_log_query(card_key_filter)
+    return keyset_paginate(
+        query, AccessLog.access_time, AccessLog.id, settings.get('per_page', 10),
+        after=after, before=before,
+        total=count_cache.get(('logs', card_key_filter), query)
+    )
+
 @app.route('/')
 def index():
+    status = request.args.get('status')
+    search = request.args.get('search', '').strip()
     try:
-        page = request.args.get('page', 1, type=int)
-        per_page = settings.get('per_page', 10)
-        status = request.args.get('status')
-        search = request.args.get('search', '').strip()
-        
-        # 获取各状态的卡密数量
-        current_time = get_local_time()
-        unused_count = Card.query.filter_by(is_used=False).count()
-        
-        # 使用中的卡密数量
-        used_cards = Card.query.filter(
-            Card.is_used == True,
-            Card.used_at != None
-        ).all()
-        used_count = sum(
-            1 for card in used_cards
-            if card.used_at + timedelta(minutes=card.minutes) > current_time
+        pagination, summary = paginate_cards(
+            status, search,
+            after=request.args.get('after'),
+            before=request.args.get('before')
         )
         
-        # 已过期的卡密数量
-        expired_count = sum(
-            1 for card in used_cards
-            if card.used_at + timedelta(minutes=card.minutes) <= current_time
-        )
-        
-        # 构建查询
-        query = Card.query
-        
-        # 应用过滤条件
-        if status:
-            if status == 'unused':
-                query = query.filter_by(is_used=False)
-            elif status == 'used':
-                # 使用中的卡密：已使用且未过期
-                query = query.filter(
-                    Card.is_used == True,
-                    Card.used_at != None
-                )
-                # 在Python中过滤未过期的卡密
-                cards = query.all()
-                valid_card_ids = [
-                    card.id for card in cards
-                    if card.used_at + timedelta(minutes=card.minutes) > current_time
-                ]
-                query = Card.query.filter(Card.id.in_(valid_card_ids))
-            elif status == 'expired':
-                # 已过期的卡密：已使用且已过期
-                query = query.filter(
-                    Card.is_used == True,
-                    Card.used_at != None
-                )
-                # 在Python中过滤已过期的卡密
-                cards = query.all()
-                expired_card_ids = [
-                    card.id for card in cards
-                    if card.used_at + timedelta(minutes=card.minutes) <= current_time
-                ]
-                query = Card.query.filter(Card.id.in_(expired_card_ids))
-        
-        # 应用搜索条件
-        if search:
-            query = query.filter(Card.card_key.like(f'%{search}%'))
-        
-        # 应用排序
-        query = query.order_by(Card.created_at.desc())
-        
-        # 执行分页
-        pagination = query.paginate(page=page, per_page=per_page, error_out=False)
-        cards = pagination.items if pagination else []
-        
         return render_template('index.html', 
-                             cards=cards, 
+                             cards=pagination.items, 
                              pagination=pagination,
                              status=status,
                              search=search,
-                             unused_count=unused_count,
-                             used_count=used_count,
-                             expired_count=expired_count,
+                             unused_count=summary['unused'],
+                             used_count=summary['in_use'],
+                             expired_count=summary['expired'],
+                             paused_count=summary['paused'],
+                             revoked_count=summary['revoked'],
                              settings=settings.settings)
     except Exception as e:
         logger.error(f"访问首页出错: {str(e)}", exc_info=True)
@@ -501,9 +1365,170 @@ def index():
                              unused_count=0,
                              used_count=0,
                              expired_count=0,
+                             paused_count=0,
+                             revoked_count=0,
                              error="获取卡密列表失败",
                              settings=settings.settings)
 
+@app.route('/api/cards')
+def list_cards():
+    """卡密列表（JSON），使用 after/before 游标翻页"""
+    try:
+        pagination, _ = paginate_cards(
+            request.args.get('status'),
+            request.args.get('search', '').strip(),
+            after=request.args.get('after'),
+            before=request.args.get('before'),
+            raw=True
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return fast_jsonify({
+        'items': Card.serialize_rows(pagination.items),
+        'total': pagination.total,
+        'prev_cursor': pagination.prev_cursor if pagination.has_prev else None,
+        'next_cursor': pagination.next_cursor if pagination.has_next else None
+    })
+
+def select_cards(data, now):
+    """根据请求中的 ids / card_keys / filter / all 选择批量操作的卡密，参数无效时抛出 ValueError"""
+    selectors = [key for key in ('ids', 'card_keys', 'filter', 'all') if key in data]
+    if len(selectors) != 1:
+        raise ValueError('需要且只能指定 ids、card_keys、filter 或 all 中的一项')
+    selector = selectors[0]
+    value = data[selector]
+    if selector == 'all':
+        # 作用于全部卡密必须显式指定 "all": true
+        if value is not True:
+            raise ValueError('无效的 all 参数')
+        return Card.query
+    if selector == 'ids':
+        if (not isinstance(value, list) or not value or
+                not all(isinstance(i, int) and not isinstance(i, bool) for i in value)):
+            raise ValueError('无效的卡密ID列表')
+        return Card.query.filter(Card.id.in_(value))
+    if selector == 'card_keys':
+        if not isinstance(value, list) or not value or not all(isinstance(k, str) for k in value):
+            raise ValueError('无效的卡密列表')
+        return Card.query.filter(Card.card_key.in_(value))
+    if not isinstance(value, dict):
+        raise ValueError('无效的筛选条件')
+    status = value.get('status')
+    search = value.get('search') or ''
+    if status is not None and status not in CARD_STATUS_FILTERS:
+        raise ValueError('无效的卡密状态')
+    if not isinstance(search, str):
+        raise ValueError('无效的搜索条件')
+    search = search.strip()
+    if not status and not search:
+        # 空筛选条件会选中全部卡密，需改用 "all": true 显式指定
+        raise ValueError('筛选条件不能为空')
+    return build_card_query(status, search, now)
+
+def update_cards(action, condition, values):
+    """对选中的卡密执行一条 UPDATE，提交后刷新统计并只广播一次"""
+    data = request.get_json(silent=True) or {}
+    now = get_local_time()
+    try:
+        query = select_cards(data, now).filter(condition(now))
+        affected = query.update(values(data, now), synchronize_session=False)
+        db.session.commit()
+    except ValueError as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        app.logger.error(f"{action}出错: {str(e)}")
+        db.session.rollback()
+        return jsonify({'error': f'{action}失败'}), 500
+
+    if affected:
+        card_summary.invalidate()
+        broadcast_card_update()
+    return jsonify({'message': f'{action}成功', 'affected': affected})
+
+def extend_values(data, now):
+    minutes = data.get('minutes')
+    if not isinstance(minutes, int) or isinstance(minutes, bool) or minutes <= 0:
+        raise ValueError('无效的分钟数')
+    return {
+        Card.minutes: Card.minutes + minutes,
+        # 非暂停卡密的 paused_remaining 为 NULL，相加后仍为 NULL
+        Card.paused_remaining: Card.paused_remaining + minutes * 60
+    }
+
+@app.route('/api/cards/extend', methods=['POST'])
+def extend_cards():
+    """批量延长卡密时长（不含已作废）"""
+    return update_cards(
+        '延长卡密时长',
+        lambda now: Card.revoked_at == None,
+        extend_values
+    )
+
+@app.route('/api/cards/pause', methods=['POST'])
+def pause_cards():
+    """批量暂停使用中的卡密，记录暂停时的剩余秒数"""
+    return update_cards(
+        '暂停卡密',
+        Card.in_use_filter,
+        lambda data, now: {
+            Card.paused_at: now,
+            Card.paused_remaining: (Card._epoch_expr(Card.used_at) + Card.minutes * 60
+                                    - Card._epoch_expr(now))
+        }
+    )
+
+@app.route('/api/cards/resume', methods=['POST'])
+def resume_cards():
+    """批量恢复已暂停的卡密，暂停时长（向上取整到分钟）补回到卡密时长"""
+    return update_cards(
+        '恢复卡密',
+        lambda now: Card.paused_filter(),
+        lambda data, now: {
+            Card.minutes: Card.minutes + (Card._epoch_expr(now) - Card._epoch_expr(Card.paused_at) + 59) // 60,
+            Card.paused_at: None,
+            Card.paused_remaining: None
+        }
+    )
+
+@app.route('/api/cards/revoke', methods=['POST'])
+def revoke_cards():
+    """批量作废卡密"""
+    return update_cards(
+        '作废卡密',
+        lambda now: Card.revoked_at == None,
+        lambda data, now: {Card.revoked_at: now}
+    )
+
+@app.route('/api/cards/<int:card_id>/usage')
+def card_usage(card_id):
+    """卡密及各设备的最近验证时间和验证次数（含尚未写入数据库的记录）"""
+    card = Card.query.get(card_id)
+    if not card:
+        return jsonify({'error': '卡密不存在'}), 404
+
+    last_verified_at, verify_count = card.last_verified_at, card.verify_count or 0
+    devices = {row.device_id: [row.last_seen_at, row.verify_count]
+               for row in CardDevice.query.filter_by(card_id=card_id).all()}
+    pending_card, pending_devices = last_seen_tracker.pending(card_id)
+    if pending_card:
+        last_verified_at = max(filter(None, [last_verified_at, pending_card[0]]))
+        verify_count += pending_card[1]
+    for device_id, (seen, count) in pending_devices.items():
+        entry = devices.setdefault(device_id, [seen, 0])
+        entry[0] = max(entry[0], seen)
+        entry[1] += count
+
+    return jsonify({
+        'card_id': card_id,
+        'last_verified_at': last_verified_at.isoformat() if last_verified_at else None,
+        'verify_count': verify_count,
+        'devices': [
+            {'device_id': device_id, 'last_seen_at': seen.isoformat(), 'verify_count': count}
+            for device_id, (seen, count) in sorted(devices.items(), key=lambda item: item[1][0], reverse=True)
+        ]
+    })
+
 @app.route('/add_card', methods=['POST'])
 def add_card():
     try:
@@ -519,6 +1544,7 @@ def add_card():
         card = Card(card_key=card_key, minutes=minutes, max_devices=max_devices)
         db.session.add(card)
         db.session.commit()
+        card_summary.cards_added()
         
         # 广播更新
         broadcast_card_update()
@@ -533,7 +1559,10 @@ def delete_card(card_id):
     try:
         card = Card.query.get_or_404(card_id)
         db.session.delete(card)
+        CardDevice.query.filter_by(card_id=card_id).delete()
         db.session.commit()
+        last_seen_tracker.discard(card_id)
+        card_summary.card_removed(card)
         
         # 广播更新
         broadcast_card_update()
@@ -543,19 +1572,39 @@ def delete_card(card_id):
         db.session.rollback()
         return jsonify({'error': '删除卡密失败'}), 500
 
+def verify_response(card, device_id, payload=None):
+    """验证接口响应：附加到期时间、缓存时长和ETag；payload 为空时返回304"""
+    expiration_time = card.get_expiration_time()
+    cache_seconds = app.config['VERIFY_CACHE_SECONDS']
+    if expiration_time:
+        remaining_seconds = int((expiration_time - get_local_time()).total_seconds())
+        if remaining_seconds > 0:
+            cache_seconds = min(cache_seconds, remaining_seconds)
+
+    if payload is None:
+        response = app.response_class(status=304)
+    else:
+        payload['expires_at'] = expiration_time.isoformat() if expiration_time else None
+        payload['cache_seconds'] = cache_seconds
+        response = jsonify(payload)
+    response.set_etag(card.state_etag(device_id))
+    response.cache_control.private = True
+    response.cache_control.max_age = cache_seconds
+    return response
+
 @app.route('/api/verify_card', methods=['POST'])
 @rate_limit
 def verify_card():
     try:
-        data = request.get_json()
-        if not data or 'card_key' not in data:
+        data = get_request_json()
+        if not isinstance(data, dict) or 'card_key' not in data:
             return jsonify({
                 'valid': False,
                 'message': '缺少卡密参数'
             }), 400
             
         card_key = data['card_key']
-        current_device_id = generate_device_id(request)
+        current_device_id = get_device_id()
         card = Card.query.filter_by(card_key=card_key).first()
         
         if not card:
@@ -564,6 +1613,26 @@ def verify_card():
                 'message': '卡密不存在'
             }), 404
         
+        # 卡密状态未变化时直接返回304，客户端继续使用缓存的 expires_at
+        if request.if_none_match.contains(card.state_etag(current_device_id)):
+            # 只有有效卡密的已绑定设备才计入验证记录（已过期、暂停的响应也会带ETag）
+            if (not card.revoked_at and not card.paused_at and not card.is_expired() and
+                    current_device_id in card.get_devices()):
+                last_seen_tracker.record(card.id, current_device_id, get_local_time())
+            return verify_response(card, current_device_id)
+        
+        # 已作废的卡密不可使用
+        if card.revoked_at:
+            return jsonify({
+                'valid': False,
+                'message': '卡密已作废'
+            }), 403
+        
+        # 兼容旧版本的MD5设备ID：已绑定的旧ID替换为新ID，不占用新的设备名额
+        if (card.is_used and current_device_id not in card.get_devices() and
+                card.replace_device(generate_legacy_device_id(request), current_device_id)):
+            db.session.commit()
+        
         # 检查设备是否允许使用
         if card.is_used and not card.is_device_allowed(current_device_id):
             return jsonify({
@@ -571,9 +1640,17 @@ def verify_card():
                 'message': f'超出最大设备数量限制（{card.max_devices}台设备）'
             }), 403
         
+        # 已暂停的卡密暂不可使用，恢复后继续计时
+        if card.paused_at:
+            return verify_response(card, current_device_id, {
+                'valid': False,
+                'remaining_minutes': card._calculate_remaining_minutes(),
+                'message': '卡密已暂停'
+            })
+        
         # 如果卡密已过期，直接返回
         if card.is_expired():
-            return jsonify({
+            return verify_response(card, current_device_id, {
                 'valid': False,
                 'remaining_minutes': 0,
                 'message': '卡密已过期'
@@ -591,15 +1668,12 @@ def verify_card():
                 }), 403
             
             db.session.commit()
+            card_summary.card_activated(card)
+            last_seen_tracker.record(card.id, current_device_id, card.used_at)
             # 立即广播更新
-            try:
-                cards = Card.query.all()
-                card_list = [card.to_dict() for card in cards]
-                socketio.emit('cards_update', {'cards': card_list})
-            except Exception as e:
-                app.logger.error(f"广播卡密更新出错: {str(e)}")
+            broadcast_card_update()
             
-            return jsonify({
+            return verify_response(card, current_device_id, {
                 'valid': True,
                 'remaining_minutes': card.minutes,
                 'message': '卡密首次使用成功'
@@ -615,16 +1689,12 @@ def verify_card():
                 }), 403
             db.session.commit()
             # 立即广播更新
-            try:
-                cards = Card.query.all()
-                card_list = [card.to_dict() for card in cards]
-                socketio.emit('cards_update', {'cards': card_list})
-            except Exception as e:
-                app.logger.error(f"广播卡密更新出错: {str(e)}")
+            broadcast_card_update()
         
         # 返回剩余时间
+        last_seen_tracker.record(card.id, current_device_id, get_local_time())
         remaining_minutes = card._calculate_remaining_minutes()
-        return jsonify({
+        return verify_response(card, current_device_id, {
             'valid': True,
             'remaining_minutes': remaining_minutes,
             'message': '卡密有效'
@@ -653,6 +1723,7 @@ def add_bulk_cards():
         cards = Card.generate_bulk_cards(minutes, count, max_devices)
         db.session.bulk_save_objects(cards)
         db.session.commit()
+        card_summary.cards_added(len(cards))
         
         # 广播更新
         broadcast_card_update()
@@ -714,6 +1785,7 @@ def import_cards():
             
         db.session.bulk_save_objects(cards)
         db.session.commit()
+        card_summary.cards_added(len(cards))
         
         # 广播更新
         broadcast_card_update()
@@ -723,6 +1795,91 @@ def import_cards():
         db.session.rollback()
         return jsonify({'error': '导入卡密失败'}), 500
 
+@app.route('/api/stats/summary')
+def stats_summary():
+    """获取各状态卡密数量，数量未变化时返回304"""
+    summary = card_summary.snapshot()
+    etag = hashlib.sha1(json.dumps(summary, sort_keys=True).encode()).hexdigest()
+    if request.if_none_match.contains(etag):
+        response = app.response_class(status=304)
+    else:
+        response = jsonify(summary)
+    response.set_etag(etag)
+    response.cache_control.max_age = UsageStats.refresh_interval
+    return response
+
+def parse_local_datetime(value):
+    """解析ISO格式时间，带时区的时间转换为本地时间"""
+    dt = datetime.fromisoformat(value)
+    if dt.tzinfo is not None:
+        dt = dt.astimezone().replace(tzinfo=None)
+    return dt
+
+def parse_stats_range():
+    """解析统计接口的时间范围参数，默认最近24小时，按小时对齐"""
+    now = get_local_time()
+    end = request.args.get('end')
+    start = request.args.get('start')
+    end = parse_local_datetime(end) if end else now
+    start = parse_local_datetime(start) if start else end - timedelta(hours=24)
+    end = UsageStats.hour_bucket(end) + timedelta(hours=1)
+    start = UsageStats.hour_bucket(start)
+    if start >= end or end - start > timedelta(hours=UsageStats.retention_hours + 24):
+        raise ValueError('invalid range')
+    return start, end
+
+def stats_response(name, build):
+    """统计接口响应：基于统计版本生成ETag，未变化时返回304"""
+    try:
+        start, end = parse_stats_range()
+        interval = request.args.get('interval', 'hour')
+        limit = request.args.get('limit', 10, type=int)
+        if interval not in ('hour', 'day') or not 0 < limit <= 100:
+            raise ValueError('invalid parameter')
+    except ValueError:
+        return jsonify({'error': '无效的查询参数'}), 400
+
+    usage_stats.refresh()
+    etag = hashlib.sha1(
+        f"{name}|{usage_stats.version}|{start.isoformat()}|{end.isoformat()}|{interval}|{limit}".encode()
+    ).hexdigest()
+    if request.if_none_match.contains(etag):
+        response = app.response_class(status=304)
+    else:
+        payload = {
+            'start': start.isoformat(),
+            'end': end.isoformat(),
+            'data': build(start, end, interval, limit)
+        }
+        response = jsonify(payload)
+    response.set_etag(etag)
+    response.cache_control.max_age = UsageStats.refresh_interval
+    return response
+
+@app.route('/api/stats/activations')
+def stats_activations():
+    """按小时/天统计卡密激活数量"""
+    return stats_response('activations', lambda start, end, interval, limit:
+                          usage_stats.activations(start, end, interval))
+
+@app.route('/api/stats/verifications')
+def stats_verifications():
+    """按状态码统计卡密验证次数"""
+    return stats_response('verifications', lambda start, end, interval, limit:
+                          usage_stats.status_codes(start, end))
+
+@app.route('/api/stats/top_devices')
+def stats_top_devices():
+    """验证次数最多的设备"""
+    return stats_response('top_devices', lambda start, end, interval, limit:
+                          usage_stats.top_devices(start, end, limit))
+
+@app.route('/api/stats/top_ips')
+def stats_top_ips():
+    """验证次数最多的IP"""
+    return stats_response('top_ips', lambda start, end, interval, limit:
+                          usage_stats.top_ips(start, end, limit))
+
 @app.route('/settings')
 def settings_page():
     return render_template('settings.html', settings=settings.settings)
@@ -742,15 +1899,14 @@ def update_settings():
         if not site_name or per_page <= 0 or rate_limit_requests <= 0 or rate_limit_window <= 0:
             return jsonify({'error': '无效的设置参数'}), 400
 
-        # 更新设置
-        settings.settings.update({
+        # 更新设置（原子写入并通知相关组件）
+        settings.update({
             'site_name': site_name,
             'per_page': per_page,
             'rate_limit_requests': rate_limit_requests,
             'rate_limit_window': rate_limit_window,
             'api_enabled': api_enabled
         })
-        settings.save()
 
         return jsonify({'message': '设置已更新'})
     except Exception as e:
@@ -759,24 +1915,14 @@ def update_settings():
 
 @app.route('/logs')
 def view_logs():
+    # 获取卡密筛选参数
+    card_key_filter = request.args.get('card_key', '').strip()
     try:
-        page = request.args.get('page', 1, type=int)
-        per_page = settings.get('per_page', 10)
-        
-        # 获取卡密筛选参数
-        card_key_filter = request.args.get('card_key', '').strip()
-        
-        query = AccessLog.query
-        
-        # 应用卡密筛选条件
-        if card_key_filter:
-            query = query.filter(AccessLog.card_key.like(f'%{card_key_filter}%'))
-        
-        # 按时间倒序排序
-        query = query.order_by(AccessLog.access_time.desc())
-        
-        # 执行分页
-        pagination = query.paginate(page=page, per_page=per_page, error_out=False)
+        pagination = paginate_logs(
+            card_key_filter,
+            after=request.args.get('after'),
+            before=request.args.get('before')
+        )
         
         return render_template('logs.html',
                              logs=pagination.items,
@@ -790,6 +1936,24 @@ def view_logs():
                              error="获取日志列表失败",
                              settings=settings.settings)
 
+@app.route('/api/logs')
+def list_logs():
+    """操作日志列表（JSON），使用 after/before 游标翻页"""
+    try:
+        pagination = paginate_logs(
+            request.args.get('card_key', '').strip(),
+            after=request.args.get('after'),
+            before=request.args.get('before')
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({
+        'items': [log.to_dict() for log in pagination.items],
+        'total': pagination.total,
+        'prev_cursor': pagination.prev_cursor if pagination.has_prev else None,
+        'next_cursor': pagination.next_cursor if pagination.has_next else None
+    })
+
 @app.route('/update_remark', methods=['POST'])
 def update_remark():
     try:
@@ -861,4 +2025,7 @@ def handle_status_check(data):
 if __name__ == '__main__':
     with app.app_context():
         db.create_all()
+        ensure_schema()
+    # 收到 SIGTERM 时正常退出，以便 atexit 写入尚未保存的验证记录
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
     socketio.run(app, host='0.0.0.0', port=8888, debug=False)
\ No newline at end of file
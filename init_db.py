@@ -1,5 +1,6 @@
-from app import app, db
+from app import app, db, ensure_schema
 
 with app.app_context():
     db.create_all()
+    ensure_schema()
     print("Database initialized successfully!") 
\ No newline at end of file
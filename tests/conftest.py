@@ -0,0 +1,7 @@
+import os
+import sys
+
+# 测试从仓库根目录导入 app，并使用根目录下的 config.json
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
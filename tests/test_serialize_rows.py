@@ -0,0 +1,82 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+import app as app_module
+from app import Card
+
+NOW = datetime(2024, 2, 18, 12, 0, 0, 500000)
+
+
+def make_card(**kwargs):
+    values = {
+        'id': 1,
+        'card_key': 'a' * 32,
+        'remark': '',
+        'minutes': 60,
+        'is_used': False,
+        'used_at': None,
+        'created_at': NOW - timedelta(days=1),
+        'max_devices': 1,
+        'device_id': None,
+        'paused_at': None,
+        'paused_remaining': None,
+        'revoked_at': None,
+        'last_verified_at': None,
+        'verify_count': None,
+    }
+    values.update(kwargs)
+    return Card(**values)
+
+
+CARDS = {
+    'unused': make_card(remark=None),
+    'in_use': make_card(
+        is_used=True, used_at=NOW - timedelta(minutes=20, seconds=30),
+        device_id='d1,d2', max_devices=2, remark='备注',
+        last_verified_at=NOW - timedelta(seconds=5), verify_count=7
+    ),
+    'in_use_last_second': make_card(
+        is_used=True, used_at=NOW - timedelta(minutes=59, seconds=59, microseconds=999999),
+        device_id='d1'
+    ),
+    'expired': make_card(is_used=True, used_at=NOW - timedelta(minutes=90), device_id='d1'),
+    'expired_exactly_now': make_card(is_used=True, used_at=NOW - timedelta(minutes=60)),
+    'paused': make_card(
+        is_used=True, used_at=NOW - timedelta(minutes=30), device_id='d1',
+        paused_at=NOW - timedelta(minutes=10), paused_remaining=2401
+    ),
+    'revoked': make_card(revoked_at=NOW - timedelta(hours=1)),
+    'revoked_in_use': make_card(
+        is_used=True, used_at=NOW - timedelta(minutes=5), revoked_at=NOW - timedelta(minutes=1)
+    ),
+    'used_without_used_at': make_card(is_used=True, used_at=None),
+}
+
+
+def to_row(card):
+    return tuple(getattr(card, column.key) for column in Card.serialize_columns())
+
+
+@pytest.fixture(autouse=True)
+def frozen_now(monkeypatch):
+    monkeypatch.setattr(app_module, 'get_local_time', lambda: NOW)
+
+
+@pytest.mark.parametrize('name', sorted(CARDS))
+def test_serialize_rows_matches_to_dict(name):
+    card = CARDS[name]
+    assert Card.serialize_rows([to_row(card)], NOW) == [card.to_dict()]
+
+
+def test_serialize_rows_preserves_order_and_key_order():
+    cards = list(CARDS.values())
+    result = Card.serialize_rows([to_row(card) for card in cards], NOW)
+    expected = [card.to_dict() for card in cards]
+    assert result == expected
+    assert [list(item) for item in result] == [list(item) for item in expected]
+
+
+def test_serialize_rows_defaults_to_current_time():
+    card = CARDS['in_use']
+    assert Card.serialize_rows([to_row(card)]) == [card.to_dict()]